@@ -1,10 +1,28 @@
 # app.py
+import time
+_BOOT_START = time.perf_counter()
+
+# pandas, plotly y numpy se importan donde se usan para acelerar el arranque
+import logging
+import os
+import threading
 import streamlit as st
-import pandas as pd
-import plotly.graph_objects as go
-import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from fetch_data import fetch_all_user_ids, fetch_user_record, assign_roles, calculate_damage
+from fetch_data import ALL_COUNTRIES, fetch_country_records
+from snapshots import save_snapshot, load_snapshot, snapshot_mtime
+from coalition import build_country_events, coalition_timeline, parse_remaining_hours
+
+# Antigüedad (segundos) a partir de la cual un snapshot se refresca en segundo plano
+SNAPSHOT_TTL = 3600
+# Cada cuántos segundos se revisa si hay snapshots nuevos en disco
+REFRESH_POLL_SECONDS = 5
+# Si está definida, los refrescos se encolan para los workers de fetch_queue
+# (mismo host, rate limit compartido) en vez de bajarse en este proceso
+FETCH_QUEUE_DB = os.environ.get("WARERA_QUEUE_DB")
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+logger = logging.getLogger("warera.app")
 
 st.set_page_config(page_title="WarEra Country Dashboard", layout="wide")
 
@@ -33,34 +51,48 @@ st.markdown(
     unsafe_allow_html=True
 )
 
-# List of countries
-ALL_COUNTRIES = {
-    "Uruguay": "6813b6d546e731854c7ac835",
-    "Argentina": "6813b6d546e731854c7ac832",
-    "Chile": "6813b6d546e731854c7ac83c",
-    "Polonia": "6813b6d446e731854c7ac7ae",
-    "Venezuela": "6813b6d546e731854c7ac858",
-    "Japón": "6813b6d546e731854c7ac81d",
-    "España": "6813b6d446e731854c7ac7a8",
-    "Sudafrica": "683ddd2c24b5a2e114af1612",
-    "Rumania": "6813b6d446e731854c7ac7b6",
-    "Suecia": "6813b6d446e731854c7ac7f2",
-    "Francia": "6813b6d446e731854c7ac79a",
-    "Lituania": "6813b6d446e731854c7ac7b8",
-    "Alemania": "6813b6d446e731854c7ac79c",
-    "Saudi Arabia": "6813b6d546e731854c7ac8cb",
-    "Iraq": "683ddd2c24b5a2e114af15c3",
-    "Portugal": "6813b6d446e731854c7ac7aa",
-    "Peru": "6813b6d546e731854c7ac83f",
-    "Brasil": "6813b6d546e731854c7ac82f",
-    "Mexico": "6813b6d446e731854c7ac7f8"
-}
+# Cache compartido entre sesiones: un snapshot se relee solo cuando cambia su mtime
+@st.cache_data(max_entries=2 * len(ALL_COUNTRIES), show_spinner=False)
+def load_snapshot_df(country_id: str, mtime: float):
+    """Snapshot de un país como (DataFrame, updated), o None si no es válido"""
+    import pandas as pd
+    snap = load_snapshot(country_id)
+    if snap is None:
+        return None
+    records, updated = snap
+    return pd.DataFrame(records), updated
+
+def adopt_disk_snapshots():
+    """Incorpora los snapshots en disco más nuevos que los datos de la sesión"""
+    adopted = 0
+    for cid_tmp in ALL_COUNTRIES.values():
+        mtime = snapshot_mtime(cid_tmp)
+        if mtime is None:
+            continue
+        snap = load_snapshot_df(cid_tmp, mtime)
+        if snap is None:
+            continue
+        df_tmp, updated = snap
+        current = st.session_state.country_updated.get(cid_tmp)
+        if current is not None and current >= updated:
+            continue
+        st.session_state.country_data[cid_tmp] = df_tmp
+        st.session_state.country_updated[cid_tmp] = updated
+        st.session_state.refresh_states[cid_tmp] = False
+        adopted += 1
+    return adopted
 
 # Inicializar estado de actualización por país
 if 'country_data' not in st.session_state:
     st.session_state.country_data = {}
     st.session_state.country_updated = {}
     st.session_state.refresh_states = {cid: True for cid in ALL_COUNTRIES.values()}
+    st.session_state.country_events = {}
+    st.session_state.startup_seconds = None
+
+    # Precargar el último snapshot guardado de cada país
+    st.session_state.preloaded_countries = adopt_disk_snapshots()
+    st.session_state.schedule_preloaded = True
 
 
 def fmt_num(n):
@@ -72,23 +104,106 @@ def fmt_num(n):
         return f"{n/1_000:.1f} K"
     return str(n)
 
+def refresh_country_snapshot(country_id: str):
+    """Descarga los datos de un país y los persiste en disco"""
+    records = fetch_country_records(country_id)
+    updated = datetime.utcnow()
+    save_snapshot(country_id, records, updated)
+    return records, updated
+
 # Cache individual por país
 @st.cache_data(ttl=3600, show_spinner=True)
 def load_single_country_df(country_id: str):
     """Carga y cachea los datos de un solo país"""
-    ids = fetch_all_user_ids(country_id)
-    records = []
-    for uid in ids:
-        rec = fetch_user_record(uid)
-        rec = assign_roles(rec)
-        rec = calculate_damage(rec)
-        records.append(rec)
+    import pandas as pd
+    records, updated = refresh_country_snapshot(country_id)
     df = pd.DataFrame(records)
-    updated = datetime.utcnow()
     return df, updated
 
+# Pool y refrescos en curso (país -> future), compartidos entre todas las sesiones
+@st.cache_resource
+def get_background_refresher():
+    return {
+        "executor": ThreadPoolExecutor(max_workers=2, thread_name_prefix="warera-refresh"),
+        "futures": {},
+        "lock": threading.Lock(),
+    }
+
+def is_stale(updated):
+    return updated is None or (datetime.utcnow() - updated).total_seconds() >= SNAPSHOT_TTL
+
+def enqueue_country_refresh(country_id: str):
+    """Encola el país para los workers si no tiene trabajos en curso"""
+    from fetch_queue import connect, country_pending, enqueue_country
+    conn = connect(FETCH_QUEUE_DB)
+    try:
+        if not country_pending(conn, country_id):
+            enqueue_country(conn, country_id)
+    finally:
+        conn.close()
+
+def schedule_background_refresh(country_id: str):
+    """Lanza un refresco en segundo plano si el snapshot está viejo (uno por país)"""
+    if not is_stale(st.session_state.country_updated.get(country_id)):
+        return
+    if FETCH_QUEUE_DB:
+        enqueue_country_refresh(country_id)
+        return
+    refresher = get_background_refresher()
+    with refresher["lock"]:
+        future = refresher["futures"].get(country_id)
+        if future is not None:
+            if not future.done():
+                return
+            # Otra sesión ya lo refrescó: adopt_disk_snapshots lo toma del disco
+            if future.exception() is None and not is_stale(future.result()[1]):
+                return
+        refresher["futures"][country_id] = refresher["executor"].submit(
+            refresh_country_snapshot, country_id
+        )
+
+def pending_refreshes():
+    """IDs de los países que se están actualizando (en este proceso o en la cola)"""
+    if FETCH_QUEUE_DB:
+        from fetch_queue import connect, country_pending
+        conn = connect(FETCH_QUEUE_DB)
+        try:
+            return {c for c in ALL_COUNTRIES.values() if country_pending(conn, c)}
+        finally:
+            conn.close()
+    futures = get_background_refresher()["futures"]
+    return {c for c, future in list(futures.items()) if not future.done()}
+
+@st.fragment(run_every=REFRESH_POLL_SECONDS)
+def watch_background_refreshes():
+    """Redibuja la app cuando aparece un snapshot nuevo en disco"""
+    if adopt_disk_snapshots():
+        update_summary()
+        st.rerun()
+    pending = pending_refreshes()
+    names = [name for name, cid_tmp in ALL_COUNTRIES.items() if cid_tmp in pending]
+    if names:
+        st.caption(f"🔄 Actualizando en segundo plano: {', '.join(names)}")
+
+def report_startup():
+    """
+    Tiempo de arranque de la sesión: desde el inicio del script hasta el final
+    del primer render. No incluye el arranque del servidor de Streamlit.
+    """
+    if st.session_state.startup_seconds is None:
+        st.session_state.startup_seconds = time.perf_counter() - _BOOT_START
+        logger.info(
+            "Primer render en %.2f s (%d países precargados desde disco)",
+            st.session_state.startup_seconds, st.session_state.preloaded_countries
+        )
+    startup_caption.caption(
+        f"Primer render: {st.session_state.startup_seconds:.2f} s · "
+        f"{st.session_state.preloaded_countries} países precargados"
+    )
+
 # Función para generar/actualizar el resumen
 def update_summary():
+    import pandas as pd
     summary_data = []
     for name, cid_tmp in ALL_COUNTRIES.items():
         # Solo incluir países que están cargados
@@ -119,10 +234,29 @@ def update_summary():
     # Almacenar en el estado de la sesión
     st.session_state.summary_data = pd.DataFrame(summary_data)
 
+def get_country_events(country_id):
+    """Eventos de disponibilidad de daño; se recalculan solo si cambian los datos"""
+    updated = st.session_state.country_updated.get(country_id)
+    cached = st.session_state.country_events.get(country_id)
+    if cached is None or cached[0] != updated:
+        df_tmp = st.session_state.country_data[country_id]
+        cached = (updated, build_country_events(df_tmp.to_dict("records"), updated))
+        st.session_state.country_events[country_id] = cached
+    return cached[1]
+
 # Inicializar resumen si no existe
 if 'summary_data' not in st.session_state:
     update_summary()
 
+if adopt_disk_snapshots():
+    update_summary()
+
+# Al arrancar la sesión: refrescar en segundo plano todos los snapshots viejos
+if st.session_state.schedule_preloaded:
+    for cid_tmp in st.session_state.country_updated:
+        schedule_background_refresh(cid_tmp)
+    st.session_state.schedule_preloaded = False
+
 
 # Sidebar: country stats and selection
 st.sidebar.title("Country Overview")
@@ -131,7 +265,14 @@ cid = ALL_COUNTRIES[selected]
 
 st.sidebar.markdown("---")
 
-tab_dashboard, tab_summary, = st.tabs([ "📊 Country Dashboard", "🌐 All Countries Summary"])
+with st.sidebar:
+    watch_background_refreshes()
+# Se completa al final del primer render (ver report_startup)
+startup_caption = st.sidebar.empty()
+
+tab_dashboard, tab_summary, tab_coalition = st.tabs(
+    ["📊 Country Dashboard", "🌐 All Countries Summary", "⚔️ Coalition War Room"]
+)
 
 with tab_summary:
     # Sección de resumen global
@@ -156,13 +297,91 @@ with tab_summary:
     else:
         st.info("No hay datos de países cargados todavía. Por favor actualice algunos países primero.")
 
+with tab_coalition:
+    st.subheader("⚔️ Coalition War Room")
+
+    loaded = [
+        name for name, cid_tmp in ALL_COUNTRIES.items()
+        if st.session_state.country_data.get(cid_tmp) is not None
+    ]
+    if not loaded:
+        st.info("No hay datos de países cargados todavía. Por favor actualice algunos países primero.")
+    else:
+        col_a, col_b = st.columns(2)
+        coalition_a = col_a.multiselect("Coalición A", loaded, key="coalition_a")
+        coalition_b = col_b.multiselect("Coalición B", loaded, key="coalition_b")
+        horizon = st.radio(
+            "Horizonte", [24, 48], index=1, horizontal=True,
+            format_func=lambda h: f"{h} horas"
+        )
+
+        overlap = set(coalition_a) & set(coalition_b)
+        if overlap:
+            st.warning(f"Países en ambas coaliciones: {', '.join(sorted(overlap))}")
+
+        if coalition_a or coalition_b:
+            import plotly.graph_objects as go
+
+            # Daño disponible = soldados activos sin debuff
+            t_start = time.perf_counter()
+            now = datetime.utcnow()
+            timelines = {}
+            for label, names in (("Coalición A", coalition_a), ("Coalición B", coalition_b)):
+                if names:
+                    timelines[label] = coalition_timeline(
+                        (get_country_events(ALL_COUNTRIES[n]) for n in names), now, horizon
+                    )
+            elapsed_ms = (time.perf_counter() - t_start) * 1000
+
+            fig = go.Figure()
+            comparison = []
+            colors = {"Coalición A": "blue", "Coalición B": "red"}
+            for label, (hours, damage) in timelines.items():
+                fig.add_trace(go.Scatter(
+                    x=hours,
+                    y=damage,
+                    mode='lines',
+                    line_shape='hv',
+                    name=label,
+                    line=dict(color=colors[label], width=3),
+                    hovertemplate='+%{x:.1f} h: %{y:,.0f}<extra>' + label + '</extra>'
+                ))
+                i_min = min(range(len(damage)), key=damage.__getitem__)
+                comparison.append({
+                    'Coalition': label,
+                    'Countries': ', '.join(coalition_a if label == "Coalición A" else coalition_b),
+                    'Now': fmt_num(round(damage[0])),
+                    'Min': fmt_num(round(damage[i_min])),
+                    'Min at': f"+{hours[i_min]:.1f} h",
+                    'Max': fmt_num(round(max(damage))),
+                })
+
+            fig.update_layout(
+                title='Daño disponible (soldados activos sin debuff)',
+                xaxis_title='Horas desde ahora',
+                yaxis_title='Daño disponible',
+                hovermode='x unified',
+                height=600,
+                xaxis=dict(showgrid=True, tickmode='linear', dtick=6),
+                yaxis=dict(showgrid=True, zeroline=True)
+            )
+            st.plotly_chart(fig, use_container_width=True)
+
+            import pandas as pd
+            st.dataframe(pd.DataFrame(comparison), use_container_width=True, hide_index=True)
+            st.caption(f"Línea de tiempo recalculada en {elapsed_ms:.1f} ms")
+
 
 with tab_dashboard:
     # Main display for selected country
     st.title(f"📊 {selected} Dashboard")
     
     # Cargar datos del país seleccionado
-    if st.session_state.refresh_states.get(cid, True):
+    if st.session_state.refresh_states.get(cid, True) and FETCH_QUEUE_DB:
+        # Sin snapshot en disco: lo bajan los workers y aparece al terminar
+        enqueue_country_refresh(cid)
+        df, last_updated = None, None
+    elif st.session_state.refresh_states.get(cid, True):
         with st.spinner(f"Loading {selected} data..."):
             df, last_updated = load_single_country_df(cid)
             st.session_state.country_data[cid] = df
@@ -174,16 +393,26 @@ with tab_dashboard:
     else:
         df = st.session_state.country_data.get(cid)
         last_updated = st.session_state.country_updated.get(cid, datetime.utcnow())
+        # Datos precargados: mostrar ya y refrescar en segundo plano si están viejos
+        schedule_background_refresh(cid)
+
+    if cid in pending_refreshes():
+        st.caption("🔄 Actualizando en segundo plano…")
 
     if df is None or df.empty:
         st.warning(f"No data available for {selected}. Try refreshing.")
+        report_startup()
         st.stop()
 
     # Botón de actualización para el país seleccionado
     if st.button(f"🔄 Refresh {selected} Data", key=f"refresh_selected_{cid}"):
-        load_single_country_df.clear(cid)
-        st.session_state.refresh_states[cid] = True
-        st.rerun()
+        if FETCH_QUEUE_DB:
+            enqueue_country_refresh(cid)
+            st.toast(f"{selected} encolado para actualizar")
+        else:
+            load_single_country_df.clear(cid)
+            st.session_state.refresh_states[cid] = True
+            st.rerun()
 
     # Relative time to last update
     if last_updated:
@@ -251,29 +480,15 @@ with tab_dashboard:
 
     # Preparar datos para el gráfico
     if 'Current Condition' in df.columns and 'Tiempo restante' in df.columns:
+        import numpy as np
+        import plotly.graph_objects as go
+
         # Filtrar solo ciudadanos con buff o debuff activo
         buff_debuff_df = df[df['Current Condition'].isin(['Buffed', 'Debuff'])].copy()
         
         if not buff_debuff_df.empty:
-            # Función para convertir tiempo a horas
-            def tiempo_a_horas(tiempo_str):
-                if tiempo_str in ["-", "Expired"]:
-                    return 0
-                try:
-                    horas = 0
-                    minutos = 0
-                    partes = tiempo_str.split()
-                    for parte in partes:
-                        if 'h' in parte:
-                            horas = int(parte.replace('h', ''))
-                        if 'm' in parte:
-                            minutos = int(parte.replace('m', ''))
-                    return horas + minutos / 60
-                except:
-                    return 0
-            
-            # Aplicar conversión
-            buff_debuff_df['horas_restantes'] = buff_debuff_df['Tiempo restante'].apply(tiempo_a_horas)
+            # Convertir el tiempo restante a horas
+            buff_debuff_df['horas_restantes'] = buff_debuff_df['Tiempo restante'].apply(parse_remaining_hours)
             
             # Obtener la hora actual en UTC
             now = datetime.utcnow()
@@ -400,7 +615,5 @@ with tab_dashboard:
     else:
         st.warning("Datos de buff/debuff no disponibles")
 
-
-
-
-
+# Tiempo hasta el final del primer render
+report_startup()
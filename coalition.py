@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+Línea de tiempo de daño disponible para coaliciones de países.
+
+Para cada país se precalcula (una vez por actualización) una lista ordenada de
+puntos de cambio: (instante, delta de daño). El daño disponible es el de los
+soldados activos que no están en debuff. Una coalición se resuelve mezclando
+las listas con un k-way merge (heapq.merge), sin volver a recorrer DataFrames.
+"""
+
+import heapq
+import math
+from datetime import datetime, timezone
+
+SOLDIER_ROLES = ("Soldado", "Super Soldado")
+DEBUFF_HOURS  = 16   # duración del debuff que sigue a un buff
+MIN_LEVEL     = 5
+
+
+def parse_remaining_hours(tiempo_str):
+    """Convierte "3h 25m" a horas; "-", "Expired" o valores raros -> 0."""
+    if not isinstance(tiempo_str, str) or tiempo_str in ("-", "Expired"):
+        return 0
+    horas = minutos = 0
+    try:
+        for parte in tiempo_str.split():
+            if parte.endswith("h"):
+                horas = int(parte[:-1])
+            elif parte.endswith("m"):
+                minutos = int(parte[:-1])
+    except ValueError:
+        return 0
+    return horas + minutos / 60
+
+
+def to_number(value):
+    """Número o 0 si falta: los registros de df.to_dict() traen NaN en los huecos."""
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return 0
+    return 0 if math.isnan(number) else number
+
+
+def condition_end_ts(rec, t0):
+    """
+    Fin del buff/debuff en epoch segundos.
+
+    Usa conditionEndAt (hora absoluta de la API); los snapshots viejos no lo
+    tienen y se estima con la hora de actualización + "Tiempo restante".
+    """
+    end_at = rec.get("conditionEndAt")
+    if isinstance(end_at, str) and end_at:
+        try:
+            return datetime.fromisoformat(end_at.replace("Z", "+00:00")).timestamp()
+        except ValueError:
+            pass
+    return t0 + parse_remaining_hours(rec.get("Tiempo restante")) * 3600
+
+
+def build_country_events(records, updated):
+    """
+    Devuelve (base, eventos) para un país.
+
+    base es el daño disponible antes de cualquier evento y eventos es una
+    lista ordenada de (epoch_segundos, delta); los eventos ya pasados se
+    acumulan al proyectar desde "ahora" en coalition_timeline.
+    """
+    t0 = updated.replace(tzinfo=timezone.utc).timestamp()
+    base = 0
+    events = []
+    for rec in records:
+        # NaN es truthy: solo cuenta como activo un True explícito
+        if rec.get("active") != True or to_number(rec.get("level")) < MIN_LEVEL:
+            continue
+        if rec.get("primaryRole") not in SOLDIER_ROLES:
+            continue
+        damage = to_number(rec.get("calculated_damage"))
+        condition = rec.get("Current Condition")
+        if condition == "Debuff":
+            # No disponible hasta que termine el debuff
+            events.append((condition_end_ts(rec, t0), damage))
+        elif condition == "Buffed":
+            end = condition_end_ts(rec, t0)
+            base += damage
+            events.append((end, -damage))
+            events.append((end + DEBUFF_HOURS * 3600, damage))
+        else:
+            base += damage
+    events.sort()
+    return base, events
+
+
+def coalition_timeline(country_events, now, horizon_hours=48):
+    """
+    Mezcla los eventos de varios países en una sola curva escalonada.
+
+    country_events: iterable de (base, eventos) de build_country_events.
+    now: datetime UTC (naive) desde el que se proyecta.
+    Devuelve (horas, daño) con un punto por cada cambio dentro del horizonte.
+    """
+    start = now.replace(tzinfo=timezone.utc).timestamp()
+    end = start + horizon_hours * 3600
+    country_events = list(country_events)
+
+    current = sum(base for base, _ in country_events)
+    hours, damage = [0.0], [current]
+    for ts, delta in heapq.merge(*(events for _, events in country_events)):
+        if ts > end:
+            break
+        current += delta
+        if ts <= start:
+            # Cambios ya ocurridos desde la última actualización del país
+            damage[0] = current
+            continue
+        h = (ts - start) / 3600
+        if h == hours[-1]:
+            damage[-1] = current
+        else:
+            hours.append(h)
+            damage.append(current)
+    hours.append(float(horizon_hours))
+    damage.append(current)
+    return hours, damage
@@ -5,10 +5,8 @@ Created on Wed Jul 16 17:26:06 2025
 @author: d908896
 """
 
-import requests
 import json
 import time
-import pandas as pd
 from datetime import datetime, timedelta, timezone
 
 from wera_extendido_v2 import evaluate_custom_distribution, build_stats_with_equipment
@@ -16,8 +14,32 @@ from wera_extendido_v2 import evaluate_custom_distribution, build_stats_with_equ
 API_BASE    = "https://api2.warera.io/trpc"
 COUNTRY_ID  = "6813b6d546e731854c7ac835"
 PAGE_SIZE   = 100
+HTTP_TIMEOUT = 30   # segundos por request a la API
 OUTPUT_CSV  = "country_skill_levels_with_damage.csv"
 
+# List of countries
+ALL_COUNTRIES = {
+    "Uruguay": "6813b6d546e731854c7ac835",
+    "Argentina": "6813b6d546e731854c7ac832",
+    "Chile": "6813b6d546e731854c7ac83c",
+    "Polonia": "6813b6d446e731854c7ac7ae",
+    "Venezuela": "6813b6d546e731854c7ac858",
+    "Japón": "6813b6d546e731854c7ac81d",
+    "España": "6813b6d446e731854c7ac7a8",
+    "Sudafrica": "683ddd2c24b5a2e114af1612",
+    "Rumania": "6813b6d446e731854c7ac7b6",
+    "Suecia": "6813b6d446e731854c7ac7f2",
+    "Francia": "6813b6d446e731854c7ac79a",
+    "Lituania": "6813b6d446e731854c7ac7b8",
+    "Alemania": "6813b6d446e731854c7ac79c",
+    "Saudi Arabia": "6813b6d546e731854c7ac8cb",
+    "Iraq": "683ddd2c24b5a2e114af15c3",
+    "Portugal": "6813b6d446e731854c7ac7aa",
+    "Peru": "6813b6d546e731854c7ac83f",
+    "Brasil": "6813b6d546e731854c7ac82f",
+    "Mexico": "6813b6d446e731854c7ac7f8"
+}
+
 # Default equipment stats for evaluation
 def default_equipment():
     return {
@@ -44,10 +66,23 @@ COMBAT_SKILLS = [
 ]
 
 
+# Función opcional que se llama antes de cada request (p. ej. rate limit compartido)
+_request_throttle = None
+
+def set_request_throttle(fn):
+    """Registra una función que bloquea hasta que se pueda hacer otro request."""
+    global _request_throttle
+    _request_throttle = fn
+
 def call_trpc(endpoint, payload):
+    import requests
+
+    if _request_throttle is not None:
+        _request_throttle()
     resp = requests.get(
         f"{API_BASE}/{endpoint}",
-        params={"batch":"1", "input": json.dumps({"0": payload})}
+        params={"batch":"1", "input": json.dumps({"0": payload})},
+        timeout=HTTP_TIMEOUT
     )
     resp.raise_for_status()
     return resp.json()[0]["result"]["data"]
@@ -100,6 +135,9 @@ def fetch_user_record(user_id):
         rec["Current Condition"] = "None"
         end_time = None
 
+    # Fin absoluto del buff/debuff (ISO UTC); "Tiempo restante" depende de cuándo se bajó
+    rec["conditionEndAt"] = end_time
+
     if end_time:
         dt_end = datetime.fromisoformat(end_time.replace("Z", "+00:00"))
         delta = dt_end - now
@@ -180,7 +218,21 @@ def calculate_damage(rec, food_health=30, battle_duration=7):
     return rec
 
 
+def fetch_country_records(country_id):
+    """Descarga y puntúa todos los usuarios de un país (lista de dicts)."""
+    records = []
+    for uid in fetch_all_user_ids(country_id):
+        rec = fetch_user_record(uid)
+        rec = assign_roles(rec)
+        rec = calculate_damage(rec)
+        records.append(rec)
+    return records
+
+
 def main():
+    # pandas solo hace falta para exportar el CSV; no lo cargamos al importar el módulo
+    import pandas as pd
+
     print("Recopilando usuarios del país...")
     user_ids = fetch_all_user_ids(COUNTRY_ID)
     print(f"Usuarios encontrados: {len(user_ids)}\n")
@@ -0,0 +1,452 @@
+# -*- coding: utf-8 -*-
+"""
+Cola de trabajos local (SQLite) para repartir la descarga entre varios workers.
+
+El pipeline se divide en tres tipos de trabajo:
+  - "country":  fetch_all_user_ids -> guarda el roster y encola un "user" por ID
+  - "user":     fetch_user_record -> assign_roles -> calculate_damage -> resultados
+  - "snapshot": cuando un país termina, escribe su snapshot para el dashboard
+
+Cada worker reclama trabajos con un lease que renueva mientras trabaja; si
+muere, el lease vence y otro worker lo retoma. Los fallos (y los leases
+vencidos) se reintentan con backoff hasta MAX_ATTEMPTS. Todos los workers
+comparten un token bucket en la base para no pasarse de API_RATE requests/s.
+Cuando todos los trabajos de un país terminan (bien o fallidos definitivamente)
+se encola su snapshot, que incluye a los usuarios que sí se pudieron bajar.
+
+La cola funciona en un solo host: la base usa SQLite en modo WAL, que depende
+de memoria compartida y no es seguro sobre un filesystem de red. Para escalar
+se lanzan más procesos en la misma máquina (spawn N), no más máquinas.
+
+Uso:
+    python fetch_queue.py enqueue [country_id ...]   # por defecto ALL_COUNTRIES
+    python fetch_queue.py work                       # un worker
+    python fetch_queue.py spawn 8                    # 8 workers en esta máquina
+    python fetch_queue.py status
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime
+
+from fetch_data import (
+    ALL_COUNTRIES, fetch_all_user_ids, fetch_user_record, assign_roles, calculate_damage,
+    set_request_throttle
+)
+from snapshots import save_snapshot
+
+QUEUE_DB       = os.environ.get("WARERA_QUEUE_DB", "fetch_queue.db")
+LEASE_SECONDS  = 120
+MAX_ATTEMPTS   = 5
+RETRY_BACKOFF  = 10   # segundos, se multiplica por el número de intento
+IDLE_SLEEP     = 0.5
+API_RATE       = float(os.environ.get("WARERA_API_RATE", 10))   # requests/s entre todos los workers (0 = sin límite)
+API_BURST      = 10
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id           INTEGER PRIMARY KEY AUTOINCREMENT,
+    dedup_key    TEXT NOT NULL UNIQUE,
+    kind         TEXT NOT NULL,
+    payload      TEXT NOT NULL,
+    status       TEXT NOT NULL DEFAULT 'pending',
+    attempts     INTEGER NOT NULL DEFAULT 0,
+    available_at REAL NOT NULL DEFAULT 0,
+    lease_until  REAL,
+    worker       TEXT,
+    error        TEXT,
+    updated_at   REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (status, available_at);
+
+CREATE TABLE IF NOT EXISTS rosters (
+    country_id TEXT PRIMARY KEY,
+    user_ids   TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS user_records (
+    country_id TEXT NOT NULL,
+    user_id    TEXT NOT NULL,
+    record     TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (country_id, user_id)
+);
+
+CREATE TABLE IF NOT EXISTS rate_limit (
+    name       TEXT PRIMARY KEY,
+    tokens     REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+
+def connect(path=QUEUE_DB):
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def enqueue(conn, kind, dedup_key, payload):
+    """
+    Encola un trabajo. Si ya existe uno pendiente o en curso con la misma
+    clave no hace nada; si el anterior terminó (o falló) lo vuelve a poner
+    en cola. Devuelve True si el trabajo quedó (re)encolado.
+    """
+    now = time.time()
+    cur = conn.execute(
+        "INSERT INTO jobs (dedup_key, kind, payload, updated_at) VALUES (?, ?, ?, ?) "
+        "ON CONFLICT(dedup_key) DO UPDATE SET "
+        "  payload = excluded.payload, status = 'pending', attempts = 0, "
+        "  available_at = 0, lease_until = NULL, worker = NULL, error = NULL, "
+        "  updated_at = excluded.updated_at "
+        "WHERE jobs.status IN ('done', 'failed')",
+        (dedup_key, kind, json.dumps(payload), now),
+    )
+    return cur.rowcount > 0
+
+
+def enqueue_country(conn, country_id):
+    return enqueue(conn, "country", f"country:{country_id}", {"country_id": country_id})
+
+
+def enqueue_snapshot(conn, country_id):
+    return enqueue(conn, "snapshot", f"snapshot:{country_id}", {"country_id": country_id})
+
+
+def claim(conn, worker_id, lease_seconds=LEASE_SECONDS):
+    """Reclama el siguiente trabajo disponible (o con lease vencido)."""
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # Un lease vencido cuenta como intento fallido (el worker murió o se colgó)
+        expired = conn.execute(
+            "SELECT id, kind, payload FROM jobs "
+            "WHERE status = 'leased' AND lease_until < ? AND attempts >= ?",
+            (now, MAX_ATTEMPTS),
+        ).fetchall()
+        conn.executemany(
+            "UPDATE jobs SET status = 'failed', lease_until = NULL, "
+            "error = 'lease vencido tras el último intento', updated_at = ? WHERE id = ?",
+            [(now, r["id"]) for r in expired],
+        )
+        row = conn.execute(
+            "SELECT * FROM jobs "
+            "WHERE (status = 'pending' AND available_at <= ?) "
+            "   OR (status = 'leased' AND lease_until < ?) "
+            "ORDER BY id LIMIT 1",
+            (now, now),
+        ).fetchone()
+        if row is not None:
+            conn.execute(
+                "UPDATE jobs SET status = 'leased', attempts = attempts + 1, "
+                "lease_until = ?, worker = ?, updated_at = ? WHERE id = ?",
+                (now + lease_seconds, worker_id, now, row["id"]),
+            )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    for r in expired:
+        job_finished(conn, r["kind"], json.loads(r["payload"])["country_id"])
+    if row is None:
+        return None
+    job = dict(row)
+    job["attempts"] += 1
+    job["payload"] = json.loads(job["payload"])
+    return job
+
+
+def renew_lease(conn, job, worker_id, lease_seconds=LEASE_SECONDS):
+    """Extiende el lease de un trabajo en curso; False si ya no es de este worker."""
+    now = time.time()
+    cur = conn.execute(
+        "UPDATE jobs SET lease_until = ?, updated_at = ? "
+        "WHERE id = ? AND status = 'leased' AND worker = ?",
+        (now + lease_seconds, now, job["id"], worker_id),
+    )
+    return cur.rowcount > 0
+
+
+class LeaseHeartbeat(threading.Thread):
+    """Renueva el lease de un trabajo cada lease_seconds/3 hasta que se detiene."""
+
+    def __init__(self, db_path, job, worker_id, lease_seconds=LEASE_SECONDS):
+        super().__init__(daemon=True)
+        self.db_path = db_path
+        self.job = job
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self.stopped = threading.Event()
+
+    def run(self):
+        # La conexión se abre recién en la primera renovación: la mayoría de
+        # los trabajos terminan antes y no la necesitan
+        conn = None
+        try:
+            while not self.stopped.wait(self.lease_seconds / 3):
+                conn = conn or connect(self.db_path)
+                if not renew_lease(conn, self.job, self.worker_id, self.lease_seconds):
+                    break
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def acquire_token(conn, rate=None, burst=None, name="api"):
+    """
+    Token bucket compartido en la base: bloquea hasta poder hacer un request.
+    Con rate <= 0 no limita.
+    """
+    rate = API_RATE if rate is None else rate
+    burst = API_BURST if burst is None else burst
+    if rate <= 0:
+        return
+    while True:
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT tokens, updated_at FROM rate_limit WHERE name = ?", (name,)
+            ).fetchone()
+            tokens = burst if row is None else min(burst, row["tokens"] + (now - row["updated_at"]) * rate)
+            granted = tokens >= 1
+            if granted:
+                tokens -= 1
+            conn.execute(
+                "INSERT OR REPLACE INTO rate_limit (name, tokens, updated_at) VALUES (?, ?, ?)",
+                (name, tokens, now),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if granted:
+            return
+        time.sleep((1 - tokens) / rate)
+
+
+def complete(conn, job, worker_id):
+    """Marca el trabajo como terminado si este worker sigue teniendo el lease."""
+    cur = conn.execute(
+        "UPDATE jobs SET status = 'done', lease_until = NULL, error = NULL, updated_at = ? "
+        "WHERE id = ? AND status = 'leased' AND worker = ?",
+        (time.time(), job["id"], worker_id),
+    )
+    return cur.rowcount > 0
+
+
+def fail(conn, job, worker_id, error):
+    """
+    Devuelve el trabajo a la cola con backoff, o lo marca como fallido.
+    Devuelve el estado final ("pending" o "failed") o None si ya no tenía el lease.
+    """
+    now = time.time()
+    if job["attempts"] >= MAX_ATTEMPTS:
+        status, available_at = "failed", now
+    else:
+        status, available_at = "pending", now + RETRY_BACKOFF * job["attempts"]
+    cur = conn.execute(
+        "UPDATE jobs SET status = ?, available_at = ?, lease_until = NULL, error = ?, updated_at = ? "
+        "WHERE id = ? AND status = 'leased' AND worker = ?",
+        (status, available_at, str(error)[:500], now, job["id"], worker_id),
+    )
+    if cur.rowcount == 0:
+        return None
+    if status == "failed":
+        job_finished(conn, job["kind"], job["payload"]["country_id"])
+    return status
+
+
+def run_country_job(conn, country_id):
+    user_ids = fetch_all_user_ids(country_id)
+    conn.execute(
+        "INSERT OR REPLACE INTO rosters (country_id, user_ids, updated_at) VALUES (?, ?, ?)",
+        (country_id, json.dumps(user_ids), time.time()),
+    )
+    for uid in user_ids:
+        enqueue(conn, "user", f"user:{country_id}:{uid}",
+                {"country_id": country_id, "user_id": uid})
+
+
+def run_user_job(conn, country_id, user_id):
+    rec = fetch_user_record(user_id)
+    rec = assign_roles(rec)
+    rec = calculate_damage(rec)
+    conn.execute(
+        "INSERT OR REPLACE INTO user_records (country_id, user_id, record, updated_at) "
+        "VALUES (?, ?, ?, ?)",
+        (country_id, user_id, json.dumps(rec, ensure_ascii=False), time.time()),
+    )
+
+
+def country_pending(conn, country_id):
+    """True si el país todavía tiene trabajos sin terminar."""
+    prefix = f"user:{country_id}:"
+    row = conn.execute(
+        "SELECT COUNT(*) FROM jobs WHERE status IN ('pending', 'leased') "
+        "AND (dedup_key = ? OR substr(dedup_key, 1, ?) = ?)",
+        (f"country:{country_id}", len(prefix), prefix),
+    ).fetchone()
+    return row[0] > 0
+
+
+def job_finished(conn, kind, country_id):
+    """
+    Se llama cuando un trabajo llega a un estado final (done o failed). Si era
+    el último del país, encola el snapshot; la clave deduplicada garantiza que
+    lo escriba un solo worker.
+    """
+    if kind != "snapshot" and not country_pending(conn, country_id):
+        enqueue_snapshot(conn, country_id)
+
+
+def write_country_snapshot(conn, country_id):
+    """Arma el snapshot del país con los registros de su roster actual."""
+    row = conn.execute("SELECT user_ids FROM rosters WHERE country_id = ?", (country_id,)).fetchone()
+    if row is None:
+        return False
+    roster = json.loads(row["user_ids"])
+    stored = {
+        r["user_id"]: json.loads(r["record"])
+        for r in conn.execute(
+            "SELECT user_id, record FROM user_records WHERE country_id = ?", (country_id,)
+        )
+    }
+    records = [stored[uid] for uid in roster if uid in stored]
+    save_snapshot(country_id, records, datetime.utcnow())
+    print(f"📦 Snapshot de {country_id} actualizado ({len(records)} usuarios)")
+    return True
+
+
+def queue_drained(conn):
+    """True si no queda ningún trabajo pendiente ni en curso."""
+    row = conn.execute(
+        "SELECT COUNT(*) FROM jobs WHERE status IN ('pending', 'leased')"
+    ).fetchone()
+    return row[0] == 0
+
+
+def process_job(conn, job):
+    payload = job["payload"]
+    if job["kind"] == "country":
+        run_country_job(conn, payload["country_id"])
+    elif job["kind"] == "user":
+        run_user_job(conn, payload["country_id"], payload["user_id"])
+    elif job["kind"] == "snapshot":
+        write_country_snapshot(conn, payload["country_id"])
+    else:
+        raise ValueError(f"Tipo de trabajo desconocido: {job['kind']}")
+
+
+def work(db_path=QUEUE_DB, worker_id=None, exit_when_idle=False):
+    """Bucle de un worker: reclama, ejecuta y confirma trabajos."""
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+    conn = connect(db_path)
+    set_request_throttle(lambda: acquire_token(conn))
+    processed = 0
+    while True:
+        job = claim(conn, worker_id)
+        if job is None:
+            if exit_when_idle and queue_drained(conn):
+                break
+            time.sleep(IDLE_SLEEP)
+            continue
+        heartbeat = LeaseHeartbeat(db_path, job, worker_id)
+        heartbeat.start()
+        try:
+            process_job(conn, job)
+            completed = complete(conn, job, worker_id)
+            if completed:
+                job_finished(conn, job["kind"], job["payload"]["country_id"])
+        except Exception as exc:
+            fail(conn, job, worker_id, exc)
+            print(f"[{worker_id}] ✗ {job['dedup_key']} (intento {job['attempts']}): {exc}")
+            continue
+        finally:
+            heartbeat.stop()
+        if completed:
+            processed += 1
+    set_request_throttle(None)
+    conn.close()
+    return processed
+
+
+def spawn(n, db_path=QUEUE_DB, exit_when_idle=True, target=work, start_method=None):
+    """
+    Lanza N workers en procesos separados y espera a que terminen.
+
+    target es la función de entrada de cada proceso (work por defecto) y recibe
+    db_path y exit_when_idle. Con start_method "spawn" o "forkserver" el hijo
+    no hereda el estado del padre, así que target debe configurarlo él mismo.
+    """
+    ctx = multiprocessing.get_context(start_method)
+    start = time.perf_counter()
+    procs = [
+        ctx.Process(target=target, kwargs={"db_path": db_path, "exit_when_idle": exit_when_idle})
+        for _ in range(n)
+    ]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    elapsed = time.perf_counter() - start
+    print(f"{n} workers terminaron en {elapsed:.1f} s")
+    return elapsed
+
+
+def status(conn):
+    return {
+        r["status"]: r["n"]
+        for r in conn.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status")
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cola de descarga de WarEra")
+    parser.add_argument("--db", default=QUEUE_DB)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_enqueue = sub.add_parser("enqueue", help="Encolar países")
+    p_enqueue.add_argument("country_ids", nargs="*")
+
+    p_work = sub.add_parser("work", help="Ejecutar un worker")
+    p_work.add_argument("--exit-when-idle", action="store_true")
+
+    p_spawn = sub.add_parser("spawn", help="Ejecutar N workers locales")
+    p_spawn.add_argument("n", type=int)
+
+    sub.add_parser("status", help="Estado de la cola")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "enqueue":
+        conn = connect(args.db)
+        country_ids = args.country_ids or list(ALL_COUNTRIES.values())
+        added = sum(enqueue_country(conn, cid) for cid in country_ids)
+        print(f"Encolados {added} de {len(country_ids)} países")
+    elif args.command == "work":
+        work(args.db, exit_when_idle=args.exit_when_idle)
+    elif args.command == "spawn":
+        connect(args.db).close()
+        spawn(args.n, args.db)
+    elif args.command == "status":
+        print(status(connect(args.db)))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+Persistencia local de los datos de cada país.
+
+Cada país se guarda como un JSON en SNAPSHOT_DIR con los registros ya
+puntuados y la hora de actualización, para poder mostrarlos al arrancar
+sin esperar a la API.
+"""
+
+import json
+import os
+import tempfile
+from datetime import datetime
+
+SNAPSHOT_DIR = os.environ.get("WARERA_SNAPSHOT_DIR", "snapshots")
+
+
+def snapshot_path(country_id):
+    return os.path.join(SNAPSHOT_DIR, f"{country_id}.json")
+
+
+def save_snapshot(country_id, records, updated):
+    """
+    Guarda los registros de un país de forma atómica (tmp + rename).
+
+    Cada escritor usa su propio temporal, así dos procesos o hilos que
+    escriben el mismo país a la vez no se pisan: gana el último rename.
+    """
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    path = snapshot_path(country_id)
+    fd, tmp = tempfile.mkstemp(dir=SNAPSHOT_DIR, prefix=f"{country_id}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"updated": updated.isoformat(), "records": records}, f, ensure_ascii=False)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def snapshot_mtime(country_id):
+    """mtime del snapshot del país o None si no existe (sirve de versión para cachear)."""
+    try:
+        return os.path.getmtime(snapshot_path(country_id))
+    except OSError:
+        return None
+
+
+def load_snapshot(country_id):
+    """Devuelve (records, updated) o None si no hay snapshot válido."""
+    try:
+        with open(snapshot_path(country_id), encoding="utf-8") as f:
+            data = json.load(f)
+        return data["records"], datetime.fromisoformat(data["updated"])
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def load_all_snapshots(country_ids):
+    """Carga el último snapshot de cada país disponible en disco."""
+    snapshots = {}
+    for cid in country_ids:
+        snap = load_snapshot(cid)
+        if snap is not None:
+            snapshots[cid] = snap
+    return snapshots
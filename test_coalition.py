@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""Pruebas de la línea de tiempo de daño disponible por coalición."""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from coalition import build_country_events, coalition_timeline, parse_remaining_hours
+
+NOW = datetime(2025, 7, 20, 12, 0)
+
+
+def at(hours):
+    """Hora absoluta NOW + hours en el formato ISO de la API."""
+    return (NOW + timedelta(hours=hours)).isoformat() + "Z"
+
+
+def soldier(damage, condition="None", end_hours=None, **extra):
+    rec = {
+        "active": True,
+        "level": 10,
+        "primaryRole": "Soldado",
+        "calculated_damage": damage,
+        "Current Condition": condition,
+        "Tiempo restante": "-",
+    }
+    if end_hours is not None:
+        rec["conditionEndAt"] = at(end_hours)
+    rec.update(extra)
+    return rec
+
+
+def timeline(countries, horizon_hours=24):
+    return coalition_timeline(countries, NOW, horizon_hours)
+
+
+def test_debuff_buff_and_filters():
+    records = [
+        soldier(100, "Debuff", end_hours=2),
+        soldier(10, "Buffed", end_hours=1),           # debuff de 1h a 17h
+        soldier(1),
+        soldier(1000, primaryRole="Trabajador"),       # no es soldado
+        soldier(1000, active=False),                   # inactivo
+        soldier(1000, level=3),                        # nivel bajo
+    ]
+    hours, damage = timeline([build_country_events(records, NOW)])
+    assert hours == pytest.approx([0, 1, 2, 17, 24])
+    assert damage == [11, 1, 101, 111, 111]
+
+
+def test_past_events_fold_into_now():
+    records = [
+        soldier(100, "Debuff", end_hours=-1),          # ya terminó
+        soldier(10, "Buffed", end_hours=-2),           # en debuff hasta +14h
+        soldier(1),
+    ]
+    updated = NOW - timedelta(hours=3)
+    hours, damage = timeline([build_country_events(records, updated)])
+    assert hours == pytest.approx([0, 14, 24])
+    assert damage == [101, 111, 111]
+
+
+def test_merge_across_countries_with_equal_timestamps():
+    country_x = build_country_events([soldier(100, "Debuff", end_hours=3)], NOW)
+    country_y = build_country_events(
+        [soldier(50, "Debuff", end_hours=3), soldier(7, "Buffed", end_hours=3)], NOW
+    )
+    hours, damage = timeline([country_x, country_y])
+    # Los tres cambios a las 3h quedan en un solo punto
+    assert hours == pytest.approx([0, 3, 19, 24])
+    assert damage == [7, 150, 157, 157]
+
+
+def test_horizon_cutoff():
+    events = build_country_events([soldier(100, "Debuff", end_hours=30)], NOW)
+    assert timeline([events], 24) == ([0.0, 24.0], [0, 0])
+
+    hours, damage = timeline([events], 48)
+    assert hours == pytest.approx([0, 30, 48])
+    assert damage == [0, 100, 100]
+
+
+def test_legacy_snapshot_falls_back_to_tiempo_restante():
+    # Snapshots anteriores a conditionEndAt: se usa updated + "Tiempo restante"
+    updated = NOW - timedelta(hours=1)
+    records = [
+        soldier(100, "Debuff", **{"Tiempo restante": "3h 30m"}),
+        soldier(10, "Debuff", conditionEndAt=float("nan"), **{"Tiempo restante": "1h 0m"}),
+    ]
+    hours, damage = timeline([build_country_events(records, updated)])
+    assert hours == pytest.approx([0, 2.5, 24])
+    assert damage == [10, 110, 110]
+
+
+def test_nan_values_are_ignored():
+    records = [
+        soldier(float("nan")),
+        soldier(1000, level=float("nan")),
+        soldier(1000, active=float("nan")),
+        soldier(5),
+    ]
+    base, events = build_country_events(records, NOW)
+    assert (base, events) == (5, [])
+
+
+@pytest.mark.parametrize("text, hours", [
+    ("3h 30m", 3.5),
+    ("0h 15m", 0.25),
+    ("-", 0),
+    ("Expired", 0),
+    ("xh", 0),
+    (None, 0),
+])
+def test_parse_remaining_hours(text, hours):
+    assert parse_remaining_hours(text) == pytest.approx(hours)
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""Pruebas de la cola de descarga con las llamadas a la API simuladas."""
+
+import json
+import os
+import time
+
+import pytest
+
+import fetch_queue
+import snapshots
+
+USERS_PER_COUNTRY = 20
+API_LATENCY = 0.02
+
+
+def fake_user_ids(country_id):
+    time.sleep(API_LATENCY)
+    return [f"{country_id}-u{i}" for i in range(USERS_PER_COUNTRY)]
+
+
+def fake_user_record(user_id):
+    time.sleep(API_LATENCY)
+    if user_id.endswith("-bad"):
+        raise RuntimeError("usuario roto")
+    return {"username": user_id, "level": 10, "attack": 3, "active": True}
+
+
+def install_fakes():
+    """Reemplaza la API y el disco; el directorio llega por WARERA_SNAPSHOT_DIR."""
+    snapshots.SNAPSHOT_DIR = os.environ["WARERA_SNAPSHOT_DIR"]
+    fetch_queue.fetch_all_user_ids = fake_user_ids
+    fetch_queue.fetch_user_record = fake_user_record
+    fetch_queue.calculate_damage = lambda rec: {**rec, "calculated_damage": 1}
+    fetch_queue.IDLE_SLEEP = 0.05
+    fetch_queue.API_RATE = 0
+
+
+def fake_worker(db_path, exit_when_idle):
+    """
+    Entrada de los procesos de spawn(): instala los fakes en el propio hijo,
+    así la prueba no depende de que multiprocessing use fork.
+    """
+    install_fakes()
+    fetch_queue.work(db_path, exit_when_idle=exit_when_idle)
+
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    monkeypatch.setenv("WARERA_SNAPSHOT_DIR", str(tmp_path / "snapshots"))
+    # install_fakes() pisa estos valores; monkeypatch los restaura al terminar
+    monkeypatch.setattr(snapshots, "SNAPSHOT_DIR", snapshots.SNAPSHOT_DIR)
+    for name in ("fetch_all_user_ids", "fetch_user_record", "calculate_damage",
+                 "IDLE_SLEEP", "API_RATE", "MAX_ATTEMPTS", "RETRY_BACKOFF"):
+        monkeypatch.setattr(fetch_queue, name, getattr(fetch_queue, name))
+    install_fakes()
+    db_path = str(tmp_path / "queue.db")
+    conn = fetch_queue.connect(db_path)
+    yield db_path, conn
+    conn.close()
+
+
+def read_snapshot(country_id):
+    with open(snapshots.snapshot_path(country_id), encoding="utf-8") as f:
+        return json.load(f)["records"]
+
+
+def test_enqueue_dedup(queue):
+    _, conn = queue
+    assert fetch_queue.enqueue_country(conn, "A") is True
+    assert fetch_queue.enqueue_country(conn, "A") is False
+
+    job = fetch_queue.claim(conn, "w1")
+    assert fetch_queue.enqueue_country(conn, "A") is False   # en curso
+    fetch_queue.complete(conn, job, "w1")
+    assert fetch_queue.enqueue_country(conn, "A") is True    # terminado: se re-encola
+
+
+def test_fail_retries_with_backoff_then_fails(queue, monkeypatch):
+    _, conn = queue
+    monkeypatch.setattr(fetch_queue, "MAX_ATTEMPTS", 2)
+    fetch_queue.enqueue_country(conn, "A")
+
+    job = fetch_queue.claim(conn, "w1")
+    assert fetch_queue.fail(conn, job, "w1", RuntimeError("boom")) == "pending"
+    row = conn.execute("SELECT status, available_at FROM jobs").fetchone()
+    assert row["status"] == "pending"
+    assert row["available_at"] >= time.time() + fetch_queue.RETRY_BACKOFF - 1
+    assert fetch_queue.claim(conn, "w1") is None                 # todavía en backoff
+
+    conn.execute("UPDATE jobs SET available_at = 0")
+    job = fetch_queue.claim(conn, "w1")
+    assert job["attempts"] == 2
+    assert fetch_queue.fail(conn, job, "w1", RuntimeError("boom")) == "failed"
+    assert conn.execute(
+        "SELECT status FROM jobs WHERE kind = 'country'"
+    ).fetchone()["status"] == "failed"
+
+
+def test_expired_lease_is_reclaimed_until_max_attempts(queue, monkeypatch):
+    _, conn = queue
+    monkeypatch.setattr(fetch_queue, "MAX_ATTEMPTS", 2)
+    fetch_queue.enqueue_country(conn, "A")
+
+    first = fetch_queue.claim(conn, "w1", lease_seconds=-1)
+    second = fetch_queue.claim(conn, "w2", lease_seconds=-1)
+    assert second["id"] == first["id"] and second["attempts"] == 2
+    assert fetch_queue.complete(conn, first, "w1") is False      # w1 perdió el lease
+
+    # Sin más intentos: queda fallido y se encola el snapshot del país
+    assert fetch_queue.claim(conn, "w3") is None
+    assert conn.execute(
+        "SELECT status FROM jobs WHERE kind = 'country'"
+    ).fetchone()["status"] == "failed"
+    assert fetch_queue.claim(conn, "w3")["kind"] == "snapshot"
+
+
+def test_renew_lease(queue):
+    _, conn = queue
+    fetch_queue.enqueue_country(conn, "A")
+    job = fetch_queue.claim(conn, "w1", lease_seconds=-1)
+    assert fetch_queue.renew_lease(conn, job, "w1", lease_seconds=60) is True
+    assert fetch_queue.claim(conn, "w2") is None
+    assert fetch_queue.renew_lease(conn, job, "w2") is False
+
+
+def test_token_bucket_limits_rate(queue):
+    _, conn = queue
+    start = time.perf_counter()
+    for _ in range(11):
+        fetch_queue.acquire_token(conn, rate=20, burst=1)
+    assert time.perf_counter() - start >= 0.45
+
+
+def test_snapshot_written_when_a_user_fails_permanently(queue, monkeypatch):
+    db_path, conn = queue
+    monkeypatch.setattr(fetch_queue, "MAX_ATTEMPTS", 2)
+    monkeypatch.setattr(fetch_queue, "RETRY_BACKOFF", 0)
+    monkeypatch.setattr(fetch_queue, "fetch_all_user_ids", lambda cid: ["X-u0", "X-u1", "X-bad"])
+    fetch_queue.enqueue_country(conn, "X")
+
+    fetch_queue.work(db_path, exit_when_idle=True)
+
+    assert fetch_queue.status(conn) == {"done": 4, "failed": 1}
+    assert [r["username"] for r in read_snapshot("X")] == ["X-u0", "X-u1"]
+
+
+def run_countries(db_path, conn, countries, workers):
+    """
+    Encola y procesa los países con N procesos; devuelve trabajos por segundo.
+    Se mide entre el primer y el último trabajo terminado, así el arranque de
+    los procesos no cuenta.
+    """
+    for country_id in countries:
+        fetch_queue.enqueue_country(conn, country_id)
+    fetch_queue.spawn(workers, db_path, target=fake_worker, start_method="spawn")
+    row = conn.execute(
+        "SELECT COUNT(*) AS n, MIN(updated_at) AS first, MAX(updated_at) AS last "
+        "FROM jobs WHERE status = 'done'"
+    ).fetchone()
+    return (row["n"] - 1) / (row["last"] - row["first"])
+
+
+def test_spawn_processes_everything_and_scales(queue, tmp_path):
+    db_path, conn = queue
+    countries = ["A", "B", "C", "D"]
+    total_jobs = len(countries) * (USERS_PER_COUNTRY + 2)
+
+    single = run_countries(db_path, conn, countries, workers=1)
+    assert fetch_queue.status(conn) == {"done": total_jobs}
+    for country_id in countries:
+        assert len(read_snapshot(country_id)) == USERS_PER_COUNTRY
+    assert not list((tmp_path / "snapshots").glob("*.tmp"))
+
+    # Todo terminado: enqueue vuelve a poner en cola el mismo trabajo
+    parallel = run_countries(db_path, conn, countries, workers=4)
+    assert fetch_queue.status(conn) == {"done": total_jobs}
+    # Con 4 workers esperamos ~4x; se exige 1.5x para tolerar CI cargado
+    assert parallel >= 1.5 * single